@@ -1,19 +1,37 @@
 from fastapi import FastAPI, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
-import subprocess
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
 import tempfile
 import os
 import json
-from typing import List
+import orjson
+import hashlib
+from typing import Any, AsyncIterator, Coroutine, Dict, Iterator, List, Optional, Set, Tuple, Union
+from dataclasses import dataclass
+from contextlib import asynccontextmanager
+from uuid import uuid4
 import logging
-from datetime import datetime
+import logging.handlers
+import queue
 import shutil
 import zipfile
-from io import BytesIO
 import re
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Start the log listener first so encoder detection can log, and stop it
+    # last so everything logged during shutdown is still written
+    log_listener.start()
+    try:
+        await detect_video_encoder()
+        yield
+    finally:
+        log_listener.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -24,274 +42,780 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler.prepare() formats the message on the calling thread; hand
+    # the record over as is so formatting also happens on the listener thread.
+    # The listener runs in-process, so the record never has to be pickled
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# Log records are only queued on the calling thread; formatting and writing
+# them to stderr happens on the listener's thread
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+logging.getLogger().addHandler(_DeferredQueueHandler(log_queue))
+logging.getLogger().setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Resolve the binaries once rather than searching PATH on every spawn
+FFMPEG = os.environ.get("FFMPEG_BIN") or shutil.which("ffmpeg") or "ffmpeg"
+FFPROBE = os.environ.get("FFPROBE_BIN") or shutil.which("ffprobe") or "ffprobe"
+
+# Scratch space for uploads and job outputs (None = the system temp dir).
+# Point it at a tmpfs such as /dev/shm to keep these files in RAM; outputs
+# stay there for JOB_TTL_SECONDS, so size the tmpfs accordingly
+TMP_DIR = os.environ.get("FFMPEG_TMP") or None
+
+# Results are cached by the SHA-256 of the upload, least recently used
+# entries are evicted past CACHE_MAX_BYTES. Set it to 0 to disable caching.
+# Cached files are served back as job results, so the directory lives under
+# the user's cache dir and is only accessible to the server's own user
+CACHE_DIR = os.environ.get("FFMPEG_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "ffmpeg-server",
+)
+CACHE_MAX_BYTES = int(os.environ.get("FFMPEG_CACHE_MAX_BYTES", str(2 << 30)))
+
+
+def _copy_upload(video: UploadFile, path: str) -> str:
+    digest = hashlib.sha256()
+    video.file.seek(0)
+    with open(path, "wb") as f:
+        while chunk := video.file.read(CHUNK_SIZE):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+async def save_upload(video: UploadFile, path: str) -> str:
+    """Stream the upload to disk in chunks and return its SHA-256.
+
+    The upload is never read into memory in full; hashing happens on the
+    same pass so cache lookups don't need to read the file again.
+    """
+    return await run_in_threadpool(_copy_upload, video, path)
+
+
+def _concat_uploads(uploads: List[UploadFile], path: str) -> None:
+    with open(path, "wb") as f:
+        for upload in uploads:
+            upload.file.seek(0)
+            shutil.copyfileobj(upload.file, f, CHUNK_SIZE)
+
+
+async def save_uploads_concatenated(uploads: List[UploadFile], path: str) -> None:
+    # Write the uploads back to back into a single file
+    await run_in_threadpool(_concat_uploads, uploads, path)
+
+
+def cache_lookup(digest: str, name: str) -> Optional[str]:
+    if not CACHE_MAX_BYTES:
+        return None
+    entry_dir = os.path.join(CACHE_DIR, digest)
+    path = os.path.join(entry_dir, name)
+    if not os.path.exists(path):
+        return None
+    os.utime(entry_dir)  # mark as recently used
+    return path
+
+
+def _tree_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path) for f in files
+    )
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    # Results are never modified once written, so the cache can share the
+    # inode; a copy is only made when the two live on different filesystems
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _prune_cache() -> None:
+    # Stores prune concurrently from several threads, so any entry may vanish
+    # while it is being measured; it no longer counts towards the limit then
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        try:
+            size = _tree_size(entry.path)
+            entries.append((entry.stat().st_mtime, size, entry.path))
+        except FileNotFoundError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def _cache_store(digest: str, name: str, src: str) -> None:
+    if _tree_size(src) > CACHE_MAX_BYTES:
+        # It would be evicted right away, taking every other entry with it
+        return
+    # makedirs only applies the mode to the leaf, so create both levels
+    os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+    entry_dir = os.path.join(CACHE_DIR, digest)
+    os.makedirs(entry_dir, mode=0o700, exist_ok=True)
+    # Build the entry under a temporary name and rename it into place, so a
+    # concurrent lookup never sees a half-written result
+    staging = os.path.join(entry_dir, f".{uuid4().hex}")
+    if os.path.isdir(src):
+        shutil.copytree(src, staging, copy_function=_link_or_copy)
+    else:
+        _link_or_copy(src, staging)
+    try:
+        os.replace(staging, os.path.join(entry_dir, name))
+    except OSError:
+        # Another request cached the same directory first
+        shutil.rmtree(staging, ignore_errors=True)
+    _prune_cache()
+
+
+async def cache_store(digest: str, name: str, src: str) -> None:
+    """Cache a copy of a file or directory under the upload's digest.
+
+    The cache is only an optimization, so a failed store (a full disk, a
+    concurrent prune) is logged and otherwise ignored.
+    """
+    if not CACHE_MAX_BYTES:
+        return
+    try:
+        await run_in_threadpool(_cache_store, digest, name, src)
+    except OSError:
+        logger.warning("Could not cache %s for %s", name, digest, exc_info=True)
+
+
+async def pump_upload(video: UploadFile, stdin: asyncio.StreamWriter) -> None:
+    # Feed the upload to a subprocess in chunks, then close its stdin
+    await video.seek(0)
+    try:
+        while chunk := await video.read(CHUNK_SIZE):
+            stdin.write(chunk)
+            await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # The process may exit before consuming all input (e.g. ffprobe
+        # only needs the headers)
+        pass
+    finally:
+        stdin.close()
+
+
+# Finished jobs (and their output files) are kept around this long
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "3600"))
+MAX_CONCURRENT_TRANSCODES = int(os.environ.get("MAX_CONCURRENT_TRANSCODES", "2"))
+# x264 scales poorly past a handful of threads, so split the cores between
+# concurrent transcodes rather than letting each one grab all of them
+FFMPEG_THREADS = int(os.environ.get(
+    "FFMPEG_THREADS", max(1, (os.cpu_count() or 1) // MAX_CONCURRENT_TRANSCODES)
+))
+
+
+@dataclass
+class JobState:
+    id: str
+    work_dir: str
+    output_path: str
+    media_type: str
+    status: str = "queued"  # queued -> running -> done | failed
+    error: Optional[str] = None
+
+
+# Only touched from the event loop thread, so no lock is needed
+JOBS: Dict[str, JobState] = {}
+# Held around every transcode, by job workers and thumbnail extraction alike
+TRANSCODE_SLOTS = asyncio.Semaphore(MAX_CONCURRENT_TRANSCODES)
+# Keep references to running workers so they aren't garbage collected
+JOB_TASKS: Set[asyncio.Task] = set()
+
+
+def new_job(output_name: str, media_type: str) -> JobState:
+    work_dir = tempfile.mkdtemp(prefix="job-", dir=TMP_DIR)
+    return JobState(
+        id=uuid4().hex,
+        work_dir=work_dir,
+        output_path=os.path.join(work_dir, output_name),
+        media_type=media_type
+    )
+
+
+async def run_command(args: List[str], stdin: Union[UploadFile, bytes, None] = None) -> bytes:
+    """Run ffmpeg/ffprobe without blocking the event loop and return stdout.
+
+    If stdin is given (an upload or raw bytes) it is streamed into the
+    process. A non-zero exit raises an HTTPException carrying the process's
+    stderr; if the call is cancelled or fails, the process is killed.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        if isinstance(stdin, bytes):
+            stdout, stderr = await proc.communicate(stdin)
+        elif stdin is not None:
+            stdout, stderr, _ = await asyncio.gather(
+                proc.stdout.read(), proc.stderr.read(), pump_upload(stdin, proc.stdin)
+            )
+            await proc.wait()
+        else:
+            stdout, stderr = await proc.communicate()
+    except BaseException:
+        # Cancelled (e.g. at shutdown) or feeding stdin failed: don't leave
+        # the process running, writing into a dir that is about to go away
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if proc.returncode:
+        tool = "FFprobe" if args[0] == FFPROBE else "FFmpeg"
+        raise HTTPException(status_code=500, detail=f"{tool} error: {stderr.decode()}")
+    return stdout
+
+
+def concat_list_entry(path: str) -> str:
+    # Quote the path for the concat demuxer; a literal ' has to be written
+    # as '\'' since nothing is escaped inside single quotes
+    escaped = path.replace("'", "'\\''")
+    return f"file '{escaped}'\n"
+
+
+# Characters with a meaning to either the filtergraph or the option parser
+FILTER_SPECIAL_CHARS = re.compile(r"([\\':,;\[\]])")
+
+
+def escape_filter_value(value: Union[str, int, float]) -> str:
+    # A filter option value is unescaped twice, once when the filtergraph is
+    # split into filters and again when the filter's options are parsed
+    escaped = FILTER_SPECIAL_CHARS.sub(r"\\\1", str(value))
+    return FILTER_SPECIAL_CHARS.sub(r"\\\1", escaped)
+
+
+OVERLAY_KEYS = ("text", "fontSize", "fontFamily", "x", "y", "color", "backgroundColor")
+OVERLAY_STRING_KEYS = ("text", "fontFamily", "color", "backgroundColor")
+
+
+def validate_overlays(overlays) -> List[dict]:
+    """Check the parsed overlays JSON has the shape drawtext_filter expects."""
+    if not isinstance(overlays, list):
+        raise HTTPException(status_code=400, detail="Overlays must be a JSON list")
+    for i, overlay in enumerate(overlays):
+        if not isinstance(overlay, dict):
+            raise HTTPException(status_code=400, detail=f"Overlay {i} must be an object")
+        missing = [key for key in OVERLAY_KEYS if key not in overlay]
+        if missing:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Overlay {i} is missing {', '.join(missing)}"
+            )
+        for key in OVERLAY_STRING_KEYS:
+            if not isinstance(overlay[key], str):
+                raise HTTPException(status_code=400, detail=f"Overlay {i} {key} must be a string")
+    return overlays
+
+
+def drawtext_filter(overlay: dict) -> str:
+    # Convert color from hex to FFmpeg format if needed
+    color = overlay['color'].lstrip('#')
+    bg_color = overlay['backgroundColor'].lstrip('#')
+    font_file = f"/path/to/fonts/{overlay['fontFamily']}.ttf"
+    
+    # expansion=none so a % in the text isn't treated as a %{...} sequence
+    options = [
+        f"text={escape_filter_value(overlay['text'])}",
+        "expansion=none",
+        f"fontsize={escape_filter_value(overlay['fontSize'])}",
+        f"fontfile={escape_filter_value(font_file)}",
+        f"x={escape_filter_value(overlay['x'])}",
+        f"y={escape_filter_value(overlay['y'])}",
+        f"fontcolor=0x{escape_filter_value(color)}",
+        f"box=1:boxcolor=0x{escape_filter_value(bg_color)}",  # Remove the @0.5 here since we handle it in the client
+    ]
+    return "drawtext=" + ":".join(options)
+
+
+def discard_job_inputs(job: JobState) -> None:
+    # Only the output has to outlive the run; drop the uploads right away
+    for entry in os.scandir(job.work_dir):
+        if entry.path == job.output_path:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+
+
+async def _worker(job: JobState, work: Optional[Coroutine[Any, Any, None]]) -> None:
+    try:
+        try:
+            if work is not None:
+                async with TRANSCODE_SLOTS:
+                    job.status = "running"
+                    await work
+            job.status = "done"
+        except HTTPException as e:
+            job.status = "failed"
+            job.error = e.detail
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            if work is not None:
+                # Never started if the worker was cancelled waiting for a slot
+                work.close()
+            discard_job_inputs(job)
+
+        await asyncio.sleep(JOB_TTL_SECONDS)
+    finally:
+        # Also runs if the worker is cancelled at shutdown, so nothing is
+        # left behind in the scratch dir
+        JOBS.pop(job.id, None)
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+
+
+async def submit_job(job: JobState, work: Optional[Coroutine[Any, Any, None]]) -> str:
+    """Register job and run work for it in the background.
+
+    Pass work=None for a job whose output already exists; it is marked done
+    without waiting for a transcode slot.
+    """
+    JOBS[job.id] = job
+    task = asyncio.create_task(_worker(job, work))
+    JOB_TASKS.add(task)
+    task.add_done_callback(JOB_TASKS.discard)
+    return job.id
+
+
+# Hardware H.264 encoder to use instead of libx264: none | nvenc | qsv | videotoolbox
+HW_ACCEL = os.environ.get("HW_ACCEL", "none").lower()
+HW_ENCODERS = {
+    "nvenc": "h264_nvenc",
+    "qsv": "h264_qsv",
+    "videotoolbox": "h264_videotoolbox",
+}
+NVENC_PRESETS = {"fast": "p4", "slow": "p6"}
+# What NVDEC can decode straight into CUDA frames; anything else (ProRes,
+# 10-bit or 4:2:2 H.264, ...) is decoded on the CPU
+NVDEC_CODECS = {"h264", "hevc", "vp8", "vp9", "av1", "mpeg2video"}
+NVDEC_PIX_FMTS = {"yuv420p", "yuvj420p"}
+
+# Resolved at startup; stays libx264 unless the requested encoder works
+VIDEO_ENCODER = "libx264"
+
+
+async def detect_video_encoder() -> None:
+    global VIDEO_ENCODER
+    encoder = HW_ENCODERS.get(HW_ACCEL)
+    if encoder is None:
+        return
+    # An encoder being compiled in doesn't mean the device is there, so try
+    # encoding a single frame rather than grepping `ffmpeg -encoders`
+    try:
+        await run_command([
+            FFMPEG, "-hide_banner",
+            "-f", "lavfi", "-i", "color=black:s=256x256",
+            "-frames:v", "1",
+            "-c:v", encoder,
+            "-f", "null", "-"
+        ])
+    except (HTTPException, OSError):
+        logger.warning("Hardware encoder %s is unavailable, falling back to libx264", encoder)
+        return
+    VIDEO_ENCODER = encoder
+    logger.info("Using hardware encoder %s", encoder)
+
+
+def hwaccel_input_args(stream: dict) -> List[str]:
+    # Decode on the GPU and keep frames there; only valid when every filter
+    # in the graph runs on CUDA frames and NVDEC supports the probed stream
+    if (VIDEO_ENCODER == "h264_nvenc"
+            and stream.get("codec_name") in NVDEC_CODECS
+            and stream.get("pix_fmt") in NVDEC_PIX_FMTS):
+        return ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"]
+    return []
+
+
+def video_encoder_args(preset: str, crf: int, tune: Optional[str] = None) -> List[str]:
+    """Encoder options for VIDEO_ENCODER, given in libx264 preset/CRF terms."""
+    if VIDEO_ENCODER == "h264_nvenc":
+        return ["-c:v", "h264_nvenc", "-preset", NVENC_PRESETS.get(preset, "p4"),
+                "-rc", "vbr", "-cq", str(crf)]
+    if VIDEO_ENCODER == "h264_qsv":
+        return ["-c:v", "h264_qsv", "-preset", preset, "-global_quality", str(crf)]
+    if VIDEO_ENCODER == "h264_videotoolbox":
+        # Quality runs 1-100 (higher is better); this roughly tracks CRF
+        return ["-c:v", "h264_videotoolbox", "-q:v", str(max(1, 100 - 2 * crf))]
+    args = ["-c:v", "libx264", "-preset", preset, "-crf", str(crf)]
+    if tune:
+        args += ["-tune", tune]
+    return args
+
+
+def standardize_output_args() -> List[str]:
+    """Output options of the /standardize re-encode."""
+    return ["-r", "30", "-threads", str(FFMPEG_THREADS), *video_encoder_args("fast", 23)]
+
+
+def standardized_cache_name() -> str:
+    # A different encoder or encoder settings yield a different file for the
+    # same upload, so they are part of the cache key
+    config = hashlib.sha256(" ".join(standardize_output_args()).encode()).hexdigest()
+    return f"standardized-{config[:16]}.mp4"
+
+
+class _ZipStream:
+    # Write-only file object that lets zipfile emit an archive piece by piece
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(directory: str, cleanup_dir: Optional[str] = None) -> Iterator[bytes]:
+    """Yield a ZIP archive of every file in directory as it is built.
+
+    Entries are stored uncompressed. If cleanup_dir is given it is removed
+    once the archive has been produced.
+    """
+    stream = _ZipStream()
+    try:
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as zip_file:
+            for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+                zip_file.write(entry.path, entry.name)
+                yield stream.drain()
+        yield stream.drain()
+    finally:
+        if cleanup_dir is not None:
+            shutil.rmtree(cleanup_dir, ignore_errors=True)
+
 class VideoProcessor:
     @staticmethod
-    async def concatenate_videos(video1: UploadFile, video2: UploadFile) -> bytes:
-        with tempfile.TemporaryDirectory() as temp_dir:
+    async def concatenate_videos(video1: UploadFile, video2: UploadFile) -> str:
+        job = new_job("output.mp4", "video/mp4")
+        try:
             # Save uploaded files
-            video1_path = os.path.join(temp_dir, "video1.mp4")
-            video2_path = os.path.join(temp_dir, "video2.mp4")
-            concat_list = os.path.join(temp_dir, "concat.txt")
-            output_path = os.path.join(temp_dir, "output.mp4")
-            
-            # Write uploaded files to disk
-            with open(video1_path, "wb") as f:
-                f.write(await video1.read())
-            with open(video2_path, "wb") as f:
-                f.write(await video2.read())
+            video1_path = os.path.join(job.work_dir, "video1.mp4")
+            video2_path = os.path.join(job.work_dir, "video2.mp4")
             
-            # Create concat file
-            with open(concat_list, "w") as f:
-                f.write(f"file '{video1_path}'\nfile '{video2_path}'")
-            
-            # Run FFmpeg command
-            try:
-                subprocess.run([
-                    "ffmpeg", "-f", "concat", "-safe", "0",
-                    "-i", concat_list, "-c", "copy", output_path
-                ], check=True, capture_output=True)
-                
-                # Read the output file
-                with open(output_path, "rb") as f:
-                    return f.read()
-            except subprocess.CalledProcessError as e:
-                raise HTTPException(status_code=500, detail=f"FFmpeg error: {e.stderr.decode()}")
+            # Write uploaded files to disk; the concat demuxer needs to seek
+            # in them, so they can't be piped
+            await save_upload(video1, video1_path)
+            await save_upload(video2, video2_path)
+        except BaseException:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+            raise
+        
+        # Feed the concat list on stdin rather than writing it to a file
+        concat_list = concat_list_entry(video1_path) + concat_list_entry(video2_path)
+        
+        # Run FFmpeg command
+        return await submit_job(job, run_command([
+            FFMPEG, "-f", "concat", "-safe", "0",
+            "-protocol_whitelist", "file,pipe",
+            "-i", "pipe:0", "-c", "copy", job.output_path
+        ], stdin=concat_list.encode()))
 
     @staticmethod
-    async def standardize_video(video: UploadFile) -> bytes:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, "input.mp4")
-            output_path = os.path.join(temp_dir, "output.mp4")
-            
+    async def standardize_video(video: UploadFile) -> str:
+        job = new_job("output.mp4", "video/mp4")
+        input_path = os.path.join(job.work_dir, "input.mp4")
+        try:
             # Write uploaded file to disk
-            with open(input_path, "wb") as f:
-                f.write(await video.read())
-            
-            try:
-                subprocess.run([
-                    "ffmpeg", "-i", input_path,
-                    "-r", "30",
-                    "-vf", "scale=-1080:1920",
-                    "-c:v", "libx264",
-                    "-preset", "fast",
-                    "-crf", "23",
-                    output_path
-                ], check=True, capture_output=True)
-                
-                with open(output_path, "rb") as f:
-                    return f.read()
-            except subprocess.CalledProcessError as e:
-                raise HTTPException(status_code=500, detail=f"FFmpeg error: {e.stderr.decode()}")
+            digest = await save_upload(video, input_path)
+        except BaseException:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+            raise
+        
+        cache_name = standardized_cache_name()
+        cached = cache_lookup(digest, cache_name)
+        if cached:
+            # Same upload was standardized before; the job is done already
+            os.remove(input_path)
+            job.output_path = cached
+            job.status = "done"
+            return await submit_job(job, None)
+        
+        async def standardize() -> None:
+            stream, _ = await VideoProcessor.probe_video(input_path)
+            if (stream.get("codec_name") == "h264"
+                    and stream.get("width") == 1080
+                    and stream.get("height") == 1920
+                    and stream.get("r_frame_rate") == "30/1"):
+                # Already in the target format; remux instead of re-encoding
+                await run_command([
+                    FFMPEG, "-i", input_path,
+                    "-c", "copy",
+                    "-movflags", "+faststart",
+                    job.output_path
+                ])
+            else:
+                hwaccel = hwaccel_input_args(stream)
+                scale = "scale_cuda" if hwaccel else "scale"
+                await run_command([
+                    FFMPEG, *hwaccel, "-i", input_path,
+                    "-vf", f"{scale}=-1080:1920",
+                    *standardize_output_args(),
+                    job.output_path
+                ])
+            await cache_store(digest, cache_name, job.output_path)
+        
+        return await submit_job(job, standardize())
+
+    @staticmethod
+    async def probe_video(source: str, stdin: Optional[UploadFile] = None) -> Tuple[dict, dict]:
+        """Return the first video stream and the format section from ffprobe."""
+        stdout = await run_command([
+            FFPROBE, "-v", "quiet",
+            "-print_format", "json",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=codec_name,pix_fmt,width,height,r_frame_rate,bit_rate:format=bit_rate,format_name,size,duration",
+            "-i", source
+        ], stdin=stdin)
+        
+        info = json.loads(stdout)
+        
+        streams = info.get("streams") or []
+        if not streams:
+            raise HTTPException(status_code=500, detail="No video stream found")
+        # Container-level fields live in the format section, not the stream
+        return streams[0], info.get("format", {})
 
     @staticmethod
     async def get_video_specs(video: UploadFile) -> dict:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, "input.mp4")
-            info_path = os.path.join(temp_dir, "info.json")
-            
-            # Write uploaded file to disk
-            with open(input_path, "wb") as f:
-                f.write(await video.read())
-            
-            try:
-                subprocess.run([
-                    "ffprobe", "-v", "quiet",
-                    "-print_format", "json",
-                    "-select_streams", "v:0",
-                    "-show_entries", "stream=codec_name,width,height,r_frame_rate,bit_rate:stream_tags=:format=bit_rate,format_name,size",
-                    input_path,
-                    "-o", info_path
-                ], check=True, capture_output=True)
-                
-                with open(info_path, "r") as f:
-                    info = json.load(f)
-                
-                video_stream = info.get("streams", [{}])[0]
-                if not video_stream:
-                    raise HTTPException(status_code=500, detail="No video stream found")
-                
-                # Calculate fps from frame rate fraction
-                num, den = map(int, video_stream["r_frame_rate"].split("/"))
-                fps = round(num / den)
-                
-                return {
-                    "format": video_stream.get("format_name"),
-                    "size": video_stream.get("size"),
-                    "fps": fps,
-                    "width": video_stream.get("width"),
-                    "height": video_stream.get("height"),
-                    "codec": video_stream.get("codec_name"),
-                    "bitrate": video_stream.get("bit_rate")
-                }
-            except subprocess.CalledProcessError as e:
-                raise HTTPException(status_code=500, detail=f"FFprobe error: {e.stderr.decode()}")
+        # Pipe the upload straight into ffprobe; probing only reads forward,
+        # so it doesn't need a seekable file on disk
+        video_stream, container = await VideoProcessor.probe_video("pipe:0", stdin=video)
+        
+        # Calculate fps from frame rate fraction
+        num, den = map(int, video_stream.get("r_frame_rate", "0/0").split("/"))
+        fps = round(num / den) if den else None
+        
+        return {
+            "format": container.get("format_name"),
+            # ffprobe can't size a pipe, but we know how big the upload was
+            "size": container.get("size") or video.size,
+            "duration": container.get("duration"),
+            "fps": fps,
+            "width": video_stream.get("width"),
+            "height": video_stream.get("height"),
+            "codec": video_stream.get("codec_name"),
+            # Not every container records a per-stream bitrate
+            "bitrate": video_stream.get("bit_rate") or container.get("bit_rate")
+        }
 
     @staticmethod
-    async def combine_frames_to_video(frames: List[UploadFile], fps: int) -> bytes:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Save all frames
-            for i, frame in enumerate(frames):
-                frame_path = os.path.join(temp_dir, f"frame_{str(i).zfill(6)}.jpg")
-                with open(frame_path, "wb") as f:
-                    f.write(await frame.read())
-            
-            output_path = os.path.join(temp_dir, "output.mp4")
-            
-            try:
-                subprocess.run([
-                    "ffmpeg",
-                    "-framerate", str(fps),
-                    "-i", os.path.join(temp_dir, "frame_%06d.jpg"),
-                    "-c:v", "libx264",
-                    "-preset", "slow",
-                    "-crf", "18",
-                    "-pix_fmt", "yuv420p",
-                    "-movflags", "+faststart",
-                    "-tune", "film",
-                    output_path
-                ], check=True, capture_output=True)
-                
-                with open(output_path, "rb") as f:
-                    return f.read()
-            except subprocess.CalledProcessError as e:
-                raise HTTPException(status_code=500, detail=f"FFmpeg error: {e.stderr.decode()}")
+    async def combine_frames_to_video(frames: List[UploadFile], fps: int) -> str:
+        job = new_job("output.mp4", "video/mp4")
+        frames_path = os.path.join(job.work_dir, "frames")
+        try:
+            # Save all frames into one image stream instead of a file per
+            # frame; the image2pipe demuxer splits it back into frames
+            await save_uploads_concatenated(frames, frames_path)
+        except BaseException:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+            raise
+        
+        return await submit_job(job, run_command([
+            FFMPEG,
+            "-f", "image2pipe",
+            "-framerate", str(fps),
+            "-i", frames_path,
+            "-threads", str(FFMPEG_THREADS),
+            *video_encoder_args("slow", 18, tune="film"),
+            "-pix_fmt", "yuv420p",
+            "-movflags", "+faststart",
+            job.output_path
+        ]))
 
     @staticmethod
-    async def process_video_with_overlays(video: UploadFile, filters: str, fps: int) -> bytes:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, "input.mp4")
-            output_path = os.path.join(temp_dir, "output.mp4")
-            
+    async def process_video_with_overlays(video: UploadFile, filters: str, fps: int) -> str:
+        job = new_job("output.mp4", "video/mp4")
+        input_path = os.path.join(job.work_dir, "input.mp4")
+        try:
             # Write uploaded file to disk
-            with open(input_path, "wb") as f:
-                f.write(await video.read())
-            
-            try:
-                subprocess.run([
-                    "ffmpeg", "-i", input_path,
-                    "-vf", filters,
-                    "-r", str(fps),
-                    "-c:v", "libx264",
-                    "-preset", "fast",
-                    output_path
-                ], check=True, capture_output=True)
-                
-                with open(output_path, "rb") as f:
-                    return f.read()
-            except subprocess.CalledProcessError as e:
-                raise HTTPException(status_code=500, detail=f"FFmpeg error: {e.stderr.decode()}")
+            await save_upload(video, input_path)
+        except BaseException:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+            raise
+        
+        # Run the overlays as a complex filtergraph so ffmpeg can spread the
+        # filter work over FFMPEG_THREADS; audio is passed through as before
+        return await submit_job(job, run_command([
+            FFMPEG, "-i", input_path,
+            "-filter_complex_threads", str(FFMPEG_THREADS),
+            "-filter_complex", f"[0:v]{filters or 'null'}[out]",
+            "-map", "[out]", "-map", "0:a?",
+            "-r", str(fps),
+            "-threads", str(FFMPEG_THREADS),
+            *video_encoder_args("fast", 23),  # 23 is libx264's default CRF
+            job.output_path
+        ]))
 
     @staticmethod
-    async def process_video(video: UploadFile, overlays: str, fps: int) -> bytes:
-        overlays_data = json.loads(overlays)
+    async def process_video(video: UploadFile, overlays: str, fps: int) -> str:
+        try:
+            overlays_data = orjson.loads(overlays)
+        except orjson.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid overlays JSON: {e}")
+        validate_overlays(overlays_data)
         
-        # Build FFmpeg filter complex for text overlays
-        filter_complex = []
-        for i, overlay in enumerate(overlays_data):
-            # Convert color from hex to FFmpeg format if needed
-            color = overlay['color'].lstrip('#')
-            bg_color = overlay['backgroundColor'].lstrip('#')
-            
-            # Create drawtext filter for each overlay
-            text_filter = (
-                f"drawtext=text='{overlay['text']}':"
-                f"fontsize={overlay['fontSize']}:"
-                f"fontfile=/path/to/fonts/{overlay['fontFamily']}.ttf:"
-                f"x={overlay['x']}:y={overlay['y']}:"
-                f"fontcolor=0x{color}:"
-                f"box=1:boxcolor=0x{bg_color}"  # Remove the @0.5 here since we handle it in the client
-            )
-            
-            filter_complex.append(text_filter)
-        
-        # Combine all filters
-        filters = ','.join(filter_complex)
+        # Build a drawtext filter for each text overlay and chain them
+        filters = ','.join([drawtext_filter(overlay) for overlay in overlays_data])
         
         return await VideoProcessor.process_video_with_overlays(video, filters, fps)
 
     @staticmethod
-    async def generate_thumbnails(video: UploadFile, num_thumbnails: int = 3) -> bytes:
-        with tempfile.TemporaryDirectory() as temp_dir:
+    async def generate_thumbnails(video: UploadFile, num_thumbnails: int = 3) -> Iterator[bytes]:
+        temp_dir = tempfile.mkdtemp(dir=TMP_DIR)
+        try:
             input_path = os.path.join(temp_dir, "input.mp4")
             thumbnails_dir = os.path.join(temp_dir, "thumbnails")
             os.makedirs(thumbnails_dir)
             
             # Write uploaded file to disk
-            with open(input_path, "wb") as f:
-                f.write(await video.read())
+            digest = await save_upload(video, input_path)
             
-            try:
-                # Get video duration
-                duration_cmd = subprocess.run([
-                    "ffprobe", 
-                    "-v", "error",
-                    "-show_entries", "format=duration",
-                    "-of", "default=noprint_wrappers=1:nokey=1",
-                    input_path
-                ], capture_output=True, text=True, check=True)
-                duration = float(duration_cmd.stdout)
-                
-                # Calculate timestamp intervals
-                interval = duration / (num_thumbnails + 1)
-                timestamps = [interval * i for i in range(1, num_thumbnails + 1)]
-                
-                # Generate thumbnails
-                for i, timestamp in enumerate(timestamps):
-                    output_path = os.path.join(thumbnails_dir, f"thumb_{i}.jpg")
-                    subprocess.run([
-                        "ffmpeg",
+            cache_name = f"thumbnails-{num_thumbnails}"
+            cached = cache_lookup(digest, cache_name)
+            if cached:
+                # Take our own links to the cached thumbnails so a concurrent
+                # prune can't delete them while the zip is being streamed
+                try:
+                    await run_in_threadpool(
+                        shutil.copytree, cached, thumbnails_dir,
+                        copy_function=_link_or_copy, dirs_exist_ok=True
+                    )
+                except OSError:
+                    # Evicted in the meantime; generate them again
+                    pass
+                else:
+                    os.remove(input_path)
+                    return iter_zip(thumbnails_dir, cleanup_dir=temp_dir)
+            
+            # Get video duration
+            duration_output = await run_command([
+                FFPROBE,
+                "-v", "error",
+                "-show_entries", "format=duration",
+                "-of", "default=noprint_wrappers=1:nokey=1",
+                input_path
+            ])
+            duration = float(duration_output)
+            
+            # Calculate timestamp intervals
+            interval = duration / (num_thumbnails + 1)
+            timestamps = [interval * i for i in range(1, num_thumbnails + 1)]
+            
+            # Generate thumbnails. Seeking before -i jumps to the nearest
+            # keyframe, so each grab decodes at most one GOP no matter how
+            # long the video is; the grabs run in parallel
+            async def grab_frame(i: int, timestamp: float) -> None:
+                async with TRANSCODE_SLOTS:
+                    await run_command([
+                        FFMPEG,
                         "-ss", str(timestamp),
                         "-i", input_path,
                         "-vf", "scale=320:-1",  # 320px width, maintain aspect ratio
+                        "-threads", str(FFMPEG_THREADS),
                         "-vframes", "1",
                         "-q:v", "2",  # High quality (2-31, lower is better)
-                        output_path
-                    ], check=True, capture_output=True)
-                
-                # Create zip file containing thumbnails
-                zip_buffer = BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for filename in os.listdir(thumbnails_dir):
-                        file_path = os.path.join(thumbnails_dir, filename)
-                        zip_file.write(file_path, filename)
-                
-                return zip_buffer.getvalue()
-                
-            except subprocess.CalledProcessError as e:
-                raise HTTPException(status_code=500, detail=f"FFmpeg error: {e.stderr.decode()}")
+                        os.path.join(thumbnails_dir, f"thumb_{i}.jpg")
+                    ])
+
+            # A TaskGroup cancels (and so kills) the other grabs as soon as one
+            # fails, before the temp dir is removed below
+            try:
+                async with asyncio.TaskGroup() as grabs:
+                    for i, timestamp in enumerate(timestamps):
+                        grabs.create_task(grab_frame(i, timestamp))
+            except BaseExceptionGroup as e:
+                # Report the first failure, normally ffmpeg's HTTPException
+                raise e.exceptions[0]
+            
+            await cache_store(digest, cache_name, thumbnails_dir)
+            
+            # Stream a zip file containing thumbnails. JPEGs are already
+            # compressed, so store them as-is rather than deflating
+            return iter_zip(thumbnails_dir, cleanup_dir=temp_dir)
+        except BaseException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
 
 # API endpoints
-@app.post("/concatenate")
+@app.post("/concatenate", status_code=202)
 async def concatenate_videos(video1: UploadFile, video2: UploadFile):
-    result = await VideoProcessor.concatenate_videos(video1, video2)
-    return Response(content=result, media_type="video/mp4")
+    job_id = await VideoProcessor.concatenate_videos(video1, video2)
+    return {"job_id": job_id}
 
-@app.post("/standardize")
+@app.post("/standardize", status_code=202)
 async def standardize_video(video: UploadFile):
-    result = await VideoProcessor.standardize_video(video)
-    return Response(content=result, media_type="video/mp4")
+    job_id = await VideoProcessor.standardize_video(video)
+    return {"job_id": job_id}
 
 @app.post("/specs")
 async def get_video_specs(video: UploadFile):
     return await VideoProcessor.get_video_specs(video)
 
-@app.post("/combine-frames")
+@app.post("/combine-frames", status_code=202)
 async def combine_frames(frames: List[UploadFile], fps: int):
-    result = await VideoProcessor.combine_frames_to_video(frames, fps)
-    return Response(content=result, media_type="video/mp4")
+    job_id = await VideoProcessor.combine_frames_to_video(frames, fps)
+    return {"job_id": job_id}
 
-@app.post("/process-video")
+@app.post("/process-video", status_code=202)
 async def process_video(video: UploadFile, overlays: str, fps: int):
-    result = await VideoProcessor.process_video(video, overlays, fps)
-    return Response(content=result, media_type="video/mp4")
+    job_id = await VideoProcessor.process_video(video, overlays, fps)
+    return {"job_id": job_id}
 
 @app.post("/generate-thumbnails")
 async def generate_thumbnails(video: UploadFile, num_thumbnails: int = 3):
     result = await VideoProcessor.generate_thumbnails(video, num_thumbnails)
-    return Response(content=result, media_type="application/zip")
\ No newline at end of file
+    return StreamingResponse(result, media_type="application/zip")
+
+def get_job(job_id: str) -> JobState:
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/status")
+async def get_job_status(job_id: str):
+    job = get_job(job_id)
+    return {"job_id": job.id, "status": job.status, "error": job.error}
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is still {job.status}")
+    if not os.path.exists(job.output_path):
+        # A cached result can be evicted before the job itself expires
+        raise HTTPException(status_code=410, detail="Job result is no longer available")
+    # Let Starlette serve the file itself: it sets Content-Length and reads
+    # the file off the event loop
+    return FileResponse(job.output_path, media_type=job.media_type)
\ No newline at end of file
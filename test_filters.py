@@ -0,0 +1,104 @@
+import unittest
+
+from fastapi import HTTPException
+
+from app import drawtext_filter, escape_filter_value, validate_overlays
+
+SPECIAL_CHARS = "\\':,;[]"
+
+OVERLAY = {
+    "text": "hi",
+    "fontSize": 24,
+    "fontFamily": "Arial",
+    "x": 10,
+    "y": 20,
+    "color": "#ffffff",
+    "backgroundColor": "#000000",
+}
+
+
+def unescape(value: str, special: str = SPECIAL_CHARS) -> str:
+    # One round of the unescaping ffmpeg does; any special character that
+    # isn't escaped would end the value (or the filter) early
+    out = []
+    chars = iter(value)
+    for c in chars:
+        if c == "\\":
+            out.append(next(chars))
+        elif c in special:
+            raise AssertionError(f"unescaped {c!r} in {value!r}")
+        else:
+            out.append(c)
+    return "".join(out)
+
+
+def split_options(options: str) -> list:
+    # Split on the ':' separators, keeping escaped characters as they are
+    parts = [""]
+    chars = iter(options)
+    for c in chars:
+        if c == "\\":
+            parts[-1] += c + next(chars)
+        elif c == ":":
+            parts.append("")
+        else:
+            parts[-1] += c
+    return parts
+
+
+class EscapeFilterValueTest(unittest.TestCase):
+    def test_survives_both_unescaping_rounds(self):
+        for value in [*SPECIAL_CHARS, "it's 5:00, [ok]; a\\b", "100%"]:
+            with self.subTest(value=value):
+                escaped = escape_filter_value(value)
+                self.assertEqual(unescape(unescape(escaped)), value)
+
+    def test_numbers(self):
+        self.assertEqual(escape_filter_value(24), "24")
+        self.assertEqual(escape_filter_value(1.5), "1.5")
+
+
+class DrawtextFilterTest(unittest.TestCase):
+    def test_text_cannot_add_options(self):
+        overlay = {**OVERLAY, "text": "a:fontcolor=red,drawbox[x];'"}
+        # Splitting the filtergraph leaves the option separators bare
+        graph_level = unescape(drawtext_filter(overlay), special="\\',;[]")
+        options = split_options(graph_level[len("drawtext="):])
+        self.assertEqual(len(options), 9)
+        self.assertEqual(unescape(options[0][len("text="):]), overlay["text"])
+        self.assertEqual(options[1], "expansion=none")
+
+
+class ValidateOverlaysTest(unittest.TestCase):
+    def assert_rejected(self, overlays):
+        with self.assertRaises(HTTPException) as cm:
+            validate_overlays(overlays)
+        self.assertEqual(cm.exception.status_code, 400)
+
+    def test_valid(self):
+        self.assertEqual(validate_overlays([OVERLAY]), [OVERLAY])
+        self.assertEqual(validate_overlays([]), [])
+
+    def test_not_a_list(self):
+        self.assert_rejected(OVERLAY)
+        self.assert_rejected("text")
+
+    def test_entry_not_an_object(self):
+        self.assert_rejected([1])
+        self.assert_rejected([OVERLAY, ["text"]])
+
+    def test_missing_key(self):
+        for key in OVERLAY:
+            with self.subTest(key=key):
+                overlay = dict(OVERLAY)
+                del overlay[key]
+                self.assert_rejected([overlay])
+
+    def test_non_string_fields(self):
+        for key in ("text", "fontFamily", "color", "backgroundColor"):
+            with self.subTest(key=key):
+                self.assert_rejected([{**OVERLAY, key: 5}])
+
+
+if __name__ == "__main__":
+    unittest.main()